@@ -86,11 +86,18 @@ if os.path.exists('config.yml'):
 else:
     raise Exception("config.yml configuration file not found")
 
+# FastAPI runs sync routes on anyio's worker thread pool, which allows 40
+# threads by default. The pool defaults to that size so that handlers don't
+# queue waiting for a proxy to be handed back; with a smaller
+# `RPC_POOL_SIZE`, requests beyond it wait for a free proxy.
 NAMEKO_POOL = ClusterRpcProxyPool(
     uri=config['AMQP_URI'],
-    timeout=None
+    timeout=None,
+    pool_size=config.get('RPC_POOL_SIZE', 40)
 )
-NAMEKO_POOL.start()
+
+def start_nameko_pool():
+    NAMEKO_POOL.start()
 
 def destroy_nameko_pool():
     NAMEKO_POOL.stop()
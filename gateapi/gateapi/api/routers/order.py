@@ -1,16 +1,42 @@
 from os import name
-from fastapi import APIRouter, status, HTTPException
+from fastapi import APIRouter, status, HTTPException, Query
 from fastapi.params import Depends
 from typing import List
 from gateapi.api import schemas
+from gateapi.api.routing import ORJSONRoute
 from gateapi.api.dependencies import get_rpc, config
-from .exceptions import OrderNotFound
+from .exceptions import OrderNotFound, ProductNotFound, ProductNotInStock
+
+# configuration is loaded once at import, so the image root is fixed for the
+# lifetime of the process
+IMAGE_ROOT = config['PRODUCT_IMAGE_ROOT']
 
 router = APIRouter(
     prefix = "/orders",
-    tags = ['Orders']
+    tags = ['Orders'],
+    route_class = ORJSONRoute
 )
 
+def _image_urls(order_details):
+    product_ids = {item['product_id'] for item in order_details}
+    return {
+        product_id: f"{IMAGE_ROOT}/{product_id}.jpg"
+        for product_id in product_ids
+    }
+
+@router.get("", status_code=status.HTTP_200_OK)
+def list_orders(page: int = Query(1, ge=1), per_page: int = Query(50, ge=1, le=100), rpc = Depends(get_rpc)):
+    with rpc.next() as nameko:
+        orders = nameko.orders.list_orders(page=page, per_page=per_page)
+
+    # Enhance order details with image urls.
+    details = [item for order in orders['items'] for item in order['order_details']]
+    image_urls = _image_urls(details)
+    for item in details:
+        item['image'] = image_urls[item['product_id']]
+
+    return orders
+
 @router.get("/{order_id}", status_code=status.HTTP_200_OK)
 def get_order(order_id: int, rpc = Depends(get_rpc)):
     try:
@@ -26,43 +52,53 @@ def _get_order(order_id, nameko_rpc):
     # Note - this may raise a remote exception that has been mapped to
     # raise``OrderNotFound``
     with nameko_rpc.next() as nameko:
-        order = nameko.orders.get_order(order_id)
+        # Request the order and all products concurrently so that both
+        # round-trips overlap rather than running one after the other.
+        order_reply = nameko.orders.get_order.call_async(order_id)
+        products_reply = nameko.products.list.call_async()
 
-    # Retrieve all products from the products service
-    with nameko_rpc.next() as nameko:
-        product_map = {prod['id']: prod for prod in nameko.products.list()}
+        order = order_reply.result()
+
+        # Retrieve all products from the products service
+        product_map = {prod['id']: prod for prod in products_reply.result()}
 
-    # get the configured image root
-    image_root = config['PRODUCT_IMAGE_ROOT']
+    # Construct the image urls, once per distinct product.
+    details = order['order_details']
+    image_urls = _image_urls(details)
 
     # Enhance order details with product and image details.
-    for item in order['order_details']:
+    for item in details:
         product_id = item['product_id']
 
         item['product'] = product_map[product_id]
-        # Construct an image url.
-        item['image'] = '{}/{}.jpg'.format(image_root, product_id)
+        item['image'] = image_urls[product_id]
 
     return order
 
 @router.post("", status_code=status.HTTP_200_OK, response_model=schemas.CreateOrderSuccess)
 def create_order(request: schemas.CreateOrder, rpc = Depends(get_rpc)):
-    id_ =  _create_order(request.dict(), rpc)
+    try:
+        id_ =  _create_order(request.dict(), rpc)
+    except ProductNotFound as error:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(error)
+        )
+    except ProductNotInStock as error:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(error)
+        )
     return {
         'id': id_
     }
 
 def _create_order(order_data, nameko_rpc):
-    # check order product ids are valid
+    # Call orders-service to create the order. It checks the products
+    # exist and are in stock.
+    # Note - this may raise `ProductNotFound` or `ProductNotInStock`
     with nameko_rpc.next() as nameko:
-        valid_product_ids = {prod['id'] for prod in nameko.products.list()}
-        for item in order_data['order_details']:
-            if item['product_id'] not in valid_product_ids:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                    detail=f"Product with id {item['product_id']} not found"
-            )
-        # Call orders-service to create the order.
         result = nameko.orders.create_order(
             order_data['order_details']
         )
-        return result['id']
\ No newline at end of file
+        return result['id']
@@ -1,29 +1,53 @@
+import threading
+
+from cachetools import TTLCache
 from fastapi import APIRouter, status, HTTPException
 from fastapi.params import Depends
 from gateapi.api.dependencies import get_rpc
 from gateapi.api import schemas
-from .exceptions import ProductNotFound
+from gateapi.api.routing import ORJSONRoute
+from .exceptions import ProductExists, ProductNotFound
 
 router = APIRouter(
     prefix = "/products",
-    tags = ["Products"]
+    tags = ["Products"],
+    route_class = ORJSONRoute
 )
 
+# Products keyed by product id, shared between the worker threads
+PRODUCT_CACHE = TTLCache(maxsize=1024, ttl=10)
+PRODUCT_CACHE_LOCK = threading.Lock()
+
 @router.get("/{product_id}", status_code=status.HTTP_200_OK, response_model=schemas.Product)
 def get_product(product_id: str, rpc = Depends(get_rpc)):
+    with PRODUCT_CACHE_LOCK:
+        product = PRODUCT_CACHE.get(product_id)
+    if product is not None:
+        return product
     try: 
         with rpc.next() as nameko:
-            return nameko.products.get(product_id)
+            product = nameko.products.get(product_id)
     except ProductNotFound as error:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=str(error)
         )
+    with PRODUCT_CACHE_LOCK:
+        PRODUCT_CACHE[product_id] = product
+    return product
 
 @router.post("", status_code=status.HTTP_200_OK, response_model=schemas.CreateProductSuccess)
 def create_product(request: schemas.Product, rpc = Depends(get_rpc)):
     with rpc.next() as nameko:
-        nameko.products.create(request.dict())
+        try:
+            nameko.products.create(request.dict())
+        except ProductExists as error:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=str(error)
+            )
+        with PRODUCT_CACHE_LOCK:
+            PRODUCT_CACHE.pop(request.id, None)
         return {
             "id": request.id
         }
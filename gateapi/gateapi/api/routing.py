@@ -0,0 +1,30 @@
+import orjson
+from fastapi import Request
+from fastapi.routing import APIRoute
+
+
+class ORJSONRequest(Request):
+    """ Request that parses its json body with orjson rather than the
+    standard library, straight from bytes.
+    orjson.JSONDecodeError subclasses json.JSONDecodeError, so FastAPI
+    still reports malformed bodies as request validation errors.
+    """
+    async def json(self):
+        if not hasattr(self, "_json"):
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+
+class ORJSONRoute(APIRoute):
+    """ Route class handing endpoints an `ORJSONRequest`.
+    *Usage*
+        router = APIRouter(route_class=ORJSONRoute)
+    """
+    def get_route_handler(self):
+        route_handler = super().get_route_handler()
+
+        async def orjson_route_handler(request: Request):
+            request = ORJSONRequest(request.scope, request.receive)
+            return await route_handler(request)
+
+        return orjson_route_handler
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, conint
 from typing import List
 
 class Product(BaseModel):
@@ -12,7 +12,7 @@ class Product(BaseModel):
 class CreateOrderDetail(BaseModel):
     product_id: str
     price: float
-    quantity: int
+    quantity: conint(ge=1)
 
 class CreateOrder(BaseModel):
     order_details: List[CreateOrderDetail]
@@ -1,7 +1,9 @@
 import uvicorn
 from fastapi import FastAPI
 from gateapi.api.routers import order, product
-from gateapi.api.dependencies import destroy_nameko_pool, config
+from gateapi.api.dependencies import (
+    start_nameko_pool, destroy_nameko_pool, config
+)
 
 app = FastAPI()
 
@@ -12,7 +14,8 @@ app.include_router(product.router)
 # Setting up nameko cluster rpc client pool connections
 @app.on_event("startup")
 async def startup_event():
-    pass
+    # connections are opened once per worker and reused by every request
+    start_nameko_pool()
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -5,7 +5,9 @@ from nameko.exceptions import safe_for_serialization, BadRequest
 from nameko.web.handlers import HttpRequestHandler
 from werkzeug import Response
 
-from gateway.exceptions import ProductNotFound, OrderNotFound
+from gateway.exceptions import (
+    ProductExists, ProductNotFound, ProductNotInStock, OrderNotFound
+)
 
 
 class HttpEntrypoint(HttpRequestHandler):
@@ -16,6 +18,8 @@ class HttpEntrypoint(HttpRequestHandler):
         BadRequest: (400, 'BAD_REQUEST'),
         ValidationError: (400, 'VALIDATION_ERROR'),
         ProductNotFound: (404, 'PRODUCT_NOT_FOUND'),
+        ProductNotInStock: (409, 'PRODUCT_NOT_IN_STOCK'),
+        ProductExists: (409, 'PRODUCT_EXISTS'),
         OrderNotFound: (404, 'ORDER_NOT_FOUND'),
     }
 
@@ -26,5 +26,16 @@ class OrderNotFound(Exception):
 
 
 @remote_error('products.exceptions.NotFound')
+@remote_error('orders.exceptions.ProductNotFound')
 class ProductNotFound(Exception):
     pass
+
+
+@remote_error('orders.exceptions.ProductNotInStock')
+class ProductNotInStock(Exception):
+    pass
+
+
+@remote_error('products.exceptions.ProductExists')
+class ProductExists(Exception):
+    pass
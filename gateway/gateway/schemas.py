@@ -1,10 +1,11 @@
 from marshmallow import Schema, fields
+from marshmallow.validate import Range
 
 
 class CreateOrderDetailSchema(Schema):
     product_id = fields.Str(required=True)
     price = fields.Decimal(as_string=True, required=True)
-    quantity = fields.Int(required=True)
+    quantity = fields.Int(required=True, validate=Range(min=1))
 
 
 class CreateOrderSchema(Schema):
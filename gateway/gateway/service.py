@@ -1,14 +1,73 @@
-import json
+from functools import lru_cache
+from types import SimpleNamespace
 
+from cachetools import TTLCache
 from marshmallow import ValidationError
 from nameko import config
 from nameko.exceptions import BadRequest
 from nameko.rpc import RpcProxy
+import orjson
 from werkzeug import Response
 
 from gateway.entrypoints import http
-from gateway.exceptions import OrderNotFound, ProductNotFound
-from gateway.schemas import CreateOrderSchema, GetOrderSchema, ProductSchema
+from gateway.exceptions import (
+    OrderNotFound, ProductExists, ProductNotFound, ProductNotInStock
+)
+
+
+@lru_cache(maxsize=None)
+def _schemas():
+    """ Schema instances shared by all requests.
+
+    Constructing a schema walks every declared field, so they are built
+    once, on first use rather than at import to keep worker start-up cheap.
+    """
+    from gateway.schemas import (
+        CreateOrderSchema, GetOrderSchema, ProductSchema
+    )
+
+    return SimpleNamespace(
+        product=ProductSchema(strict=True),
+        create_order=CreateOrderSchema(strict=True),
+        get_order=GetOrderSchema(),
+    )
+
+
+def _image_urls(image_root, order_details):
+    """ Image urls keyed by product id, for the products in `order_details`
+    """
+    product_ids = {item['product_id'] for item in order_details}
+    return {
+        product_id: f'{image_root}/{product_id}.jpg'
+        for product_id in product_ids
+    }
+
+
+# Fields of the product representation returned by `get_product`
+PRODUCT_FIELDS = (
+    'id', 'title', 'passenger_capacity', 'maximum_speed', 'in_stock'
+)
+_PRODUCT_KEYS = frozenset(PRODUCT_FIELDS)
+
+
+def _product_to_dict(product):
+    """ Project a product from the products service onto `PRODUCT_FIELDS`
+
+    The products service already serializes products, so this skips the
+    schema dump and passes the dict through when it has exactly the
+    expected keys.
+    """
+    if product.keys() == _PRODUCT_KEYS:
+        return product
+    return {field: product[field] for field in PRODUCT_FIELDS}
+
+
+# Upper bound on the page size clients may request from `list_orders`
+MAX_ORDERS_PER_PAGE = 100
+
+# Serialized product responses, keyed by product id. Greenthreads only switch
+# on I/O, so the cache can be shared between workers without a lock.
+_product_cache = TTLCache(maxsize=1024, ttl=10)
 
 
 class GatewayService(object):
@@ -28,15 +87,16 @@ class GatewayService(object):
     def get_product(self, request, product_id):
         """Gets product by `product_id`
         """
-        product = self.products_rpc.get(product_id)
-        return Response(
-            ProductSchema().dumps(product).data,
-            mimetype='application/json'
-        )
+        body = _product_cache.get(product_id)
+        if body is None:
+            product = self.products_rpc.get(product_id)
+            body = _product_cache[product_id] = (
+                orjson.dumps(_product_to_dict(product)))
+        return Response(body, mimetype='application/json')
 
     @http(
         "POST", "/products",
-        expected_exceptions=(ValidationError, BadRequest)
+        expected_exceptions=(ValidationError, ProductExists, BadRequest)
     )
     def create_product(self, request):
         """Create a new product - product data is posted as json
@@ -58,20 +118,22 @@ class GatewayService(object):
 
         """
 
-        schema = ProductSchema(strict=True)
-
         try:
-            # load input data through a schema (for validation)
-            # Note - this may raise `ValueError` for invalid json,
-            # or `ValidationError` if data is invalid.
-            product_data = schema.loads(request.get_data(as_text=True)).data
-        except ValueError as exc:
+            payload = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError as exc:
             raise BadRequest("Invalid json: {}".format(exc))
 
+        # load input data through a schema (for validation)
+        # Note - this may raise `ValidationError` if data is invalid.
+        product_data = _schemas().product.load(payload).data
+
         # Create the product
+        # Note - this may raise `ProductExists` if the id is already taken.
         self.products_rpc.create(product_data)
+        _product_cache.pop(product_data['id'], None)
         return Response(
-            json.dumps({'id': product_data['id']}), mimetype='application/json'
+            orjson.dumps({'id': product_data['id']}),
+            mimetype='application/json'
         )
 
     @http("GET", "/orders/<int:order_id>", expected_exceptions=OrderNotFound)
@@ -83,35 +145,83 @@ class GatewayService(object):
         """
         order = self._get_order(order_id)
         return Response(
-            GetOrderSchema().dumps(order).data,
+            orjson.dumps(_schemas().get_order.dump(order).data),
             mimetype='application/json'
         )
 
     def _get_order(self, order_id):
+        # Request the order and all products concurrently so that both
+        # round-trips overlap rather than running one after the other.
+        order_reply = self.orders_rpc.get_order.call_async(order_id)
+        products_reply = self.products_rpc.list.call_async()
+
         # Retrieve order data from the orders service.
         # Note - this may raise a remote exception that has been mapped to
         # raise``OrderNotFound``
-        order = self.orders_rpc.get_order(order_id)
+        order = order_reply.result()
 
         # Retrieve all products from the products service
-        product_map = {prod['id']: prod for prod in self.products_rpc.list()}
+        product_map = {prod['id']: prod for prod in products_reply.result()}
 
-        # get the configured image root
-        image_root = config['PRODUCT_IMAGE_ROOT']
+        # Construct the image urls, once per distinct product.
+        details = order['order_details']
+        image_urls = _image_urls(config['PRODUCT_IMAGE_ROOT'], details)
 
         # Enhance order details with product and image details.
-        for item in order['order_details']:
+        for item in details:
             product_id = item['product_id']
 
             item['product'] = product_map[product_id]
-            # Construct an image url.
-            item['image'] = '{}/{}.jpg'.format(image_root, product_id)
+            item['image'] = image_urls[product_id]
 
         return order
 
+    @http("GET", "/orders", expected_exceptions=BadRequest)
+    def list_orders(self, request):
+        """Lists orders a page at a time.
+
+        The page is selected with the optional ``page`` and ``per_page``
+        query parameters, e.g. ``/orders?page=2&per_page=20``. Order details
+        are enhanced with image urls, but not with full product details.
+
+        The response contains the orders and paging information ::
+
+            {
+                "items": [{"id": 21, "order_details": [...]}, ...],
+                "page": 2,
+                "per_page": 20,
+                "total": 45
+            }
+
+        """
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 50, type=int)
+        if page < 1 or not 1 <= per_page <= MAX_ORDERS_PER_PAGE:
+            raise BadRequest(
+                "Invalid page {} or page size {}".format(page, per_page)
+            )
+
+        orders = self.orders_rpc.list_orders(page=page, per_page=per_page)
+
+        # The orders service has already serialized the orders, so they are
+        # only enhanced with image urls and passed through, rather than being
+        # dumped through a schema a second time.
+        details = [
+            item
+            for order in orders['items']
+            for item in order['order_details']
+        ]
+        image_urls = _image_urls(config['PRODUCT_IMAGE_ROOT'], details)
+        for item in details:
+            item['image'] = image_urls[item['product_id']]
+
+        return Response(orjson.dumps(orders), mimetype='application/json')
+
     @http(
         "POST", "/orders",
-        expected_exceptions=(ValidationError, ProductNotFound, BadRequest)
+        expected_exceptions=(
+            ValidationError, ProductNotFound, ProductNotInStock, BadRequest
+        )
     )
     def create_order(self, request):
         """Create a new order - order data is posted as json
@@ -140,34 +250,28 @@ class GatewayService(object):
 
         """
 
-        schema = CreateOrderSchema(strict=True)
-
         try:
-            # load input data through a schema (for validation)
-            # Note - this may raise `ValueError` for invalid json,
-            # or `ValidationError` if data is invalid.
-            order_data = schema.loads(request.get_data(as_text=True)).data
-        except ValueError as exc:
+            payload = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError as exc:
             raise BadRequest("Invalid json: {}".format(exc))
 
+        # load input data through a schema (for validation)
+        # Note - this may raise `ValidationError` if data is invalid.
+        order_data = _schemas().create_order.load(payload).data
+
         # Create the order
-        # Note - this may raise `ProductNotFound`
+        # Note - this may raise `ProductNotFound` or `ProductNotInStock`
         id_ = self._create_order(order_data)
-        return Response(json.dumps({'id': id_}), mimetype='application/json')
+        return Response(
+            orjson.dumps({'id': id_}), mimetype='application/json'
+        )
 
     def _create_order(self, order_data):
-        # check order product ids are valid
-        valid_product_ids = {prod['id'] for prod in self.products_rpc.list()}
-        for item in order_data['order_details']:
-            if item['product_id'] not in valid_product_ids:
-                raise ProductNotFound(
-                    "Product Id {}".format(item['product_id'])
-                )
-
-        # Call orders-service to create the order.
+        # Call orders-service to create the order. It checks the products
+        # exist and are in stock.
         # Dump the data through the schema to ensure the values are serialized
         # correctly.
-        serialized_data = CreateOrderSchema().dump(order_data).data
+        serialized_data = _schemas().create_order.dump(order_data).data
         result = self.orders_rpc.create_order(
             serialized_data['order_details']
         )
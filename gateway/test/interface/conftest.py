@@ -24,6 +24,7 @@ from collections import namedtuple
 from nameko import config
 from nameko.testing.services import replace_dependencies
 
+from gateway import service
 from gateway.service import GatewayService
 
 
@@ -35,6 +36,13 @@ def test_config(web_config, rabbit_config):
         yield
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """ Module level caches would otherwise leak responses between tests """
+    yield
+    service._product_cache.clear()
+
+
 @pytest.fixture
 def create_service_meta(container_factory, test_config):
     """ Returns a convenience method for creating service test instance
@@ -1,8 +1,10 @@
 import json
 
+import pytest
 from mock import call
 
-from gateway.exceptions import OrderNotFound, ProductNotFound
+from gateway.exceptions import (
+    OrderNotFound, ProductExists, ProductNotFound, ProductNotInStock)
 
 
 class TestGetProduct(object):
@@ -27,6 +29,55 @@ class TestGetProduct(object):
             "title": "The Odyssey"
         }
 
+    def test_get_product_drops_unknown_fields(
+        self, gateway_service, web_session
+    ):
+        gateway_service.products_rpc.get.return_value = {
+            "in_stock": 10,
+            "maximum_speed": 5,
+            "id": "the_odyssey",
+            "passenger_capacity": 101,
+            "title": "The Odyssey",
+            "internal_note": "not for clients"
+        }
+        response = web_session.get('/products/the_odyssey')
+        assert response.status_code == 200
+        assert "internal_note" not in response.json()
+
+    def test_product_is_cached(self, gateway_service, web_session):
+        gateway_service.products_rpc.get.return_value = {
+            "in_stock": 10,
+            "maximum_speed": 5,
+            "id": "the_odyssey",
+            "passenger_capacity": 101,
+            "title": "The Odyssey"
+        }
+        first = web_session.get('/products/the_odyssey')
+        second = web_session.get('/products/the_odyssey')
+        assert first.status_code == second.status_code == 200
+        assert first.json() == second.json()
+        assert gateway_service.products_rpc.get.call_args_list == [
+            call("the_odyssey")
+        ]
+
+    def test_product_cache_invalidated_on_create(
+        self, gateway_service, web_session
+    ):
+        product = {
+            "in_stock": 10,
+            "maximum_speed": 5,
+            "id": "the_odyssey",
+            "passenger_capacity": 101,
+            "title": "The Odyssey"
+        }
+        gateway_service.products_rpc.get.return_value = product
+        web_session.get('/products/the_odyssey')
+        web_session.post('/products', json.dumps(product))
+        web_session.get('/products/the_odyssey')
+        assert gateway_service.products_rpc.get.call_args_list == [
+            call("the_odyssey"), call("the_odyssey")
+        ]
+
     def test_product_not_found(self, gateway_service, web_session):
         gateway_service.products_rpc.get.side_effect = (
             ProductNotFound('missing'))
@@ -80,12 +131,32 @@ class TestCreateProduct(object):
         assert response.status_code == 400
         assert response.json()['error'] == 'VALIDATION_ERROR'
 
+    def test_create_product_fails_when_exists(
+        self, gateway_service, web_session
+    ):
+        gateway_service.products_rpc.create.side_effect = (
+            ProductExists('Product ID the_odyssey already exists'))
+
+        response = web_session.post(
+            '/products',
+            json.dumps({
+                "in_stock": 10,
+                "maximum_speed": 5,
+                "id": "the_odyssey",
+                "passenger_capacity": 101,
+                "title": "The Odyssey"
+            })
+        )
+        assert response.status_code == 409
+        assert response.json()['error'] == 'PRODUCT_EXISTS'
+
 
 class TestGetOrder(object):
 
     def test_can_get_order(self, gateway_service, web_session):
         # setup mock orders-service response:
-        gateway_service.orders_rpc.get_order.return_value = {
+        get_order = gateway_service.orders_rpc.get_order
+        get_order.call_async.return_value.result.return_value = {
             'id': 1,
             'order_details': [
                 {
@@ -104,7 +175,8 @@ class TestGetOrder(object):
         }
 
         # setup mock products-service response:
-        gateway_service.products_rpc.list.return_value = [
+        list_products = gateway_service.products_rpc.list
+        list_products.call_async.return_value.result.return_value = [
             {
                 'id': 'the_odyssey',
                 'title': 'The Odyssey',
@@ -163,11 +235,12 @@ class TestGetOrder(object):
         assert expected_response == response.json()
 
         # check dependencies called as expected
-        assert [call(1)] == gateway_service.orders_rpc.get_order.call_args_list
-        assert [call()] == gateway_service.products_rpc.list.call_args_list
+        assert [call(1)] == get_order.call_async.call_args_list
+        assert [call()] == list_products.call_async.call_args_list
 
     def test_order_not_found(self, gateway_service, web_session):
-        gateway_service.orders_rpc.get_order.side_effect = (
+        get_order = gateway_service.orders_rpc.get_order
+        get_order.call_async.return_value.result.side_effect = (
             OrderNotFound('missing'))
 
         # call the gateway service to get order #1
@@ -178,27 +251,71 @@ class TestGetOrder(object):
         assert payload['message'] == 'missing'
 
 
-class TestCreateOrder(object):
+class TestListOrders(object):
 
-    def test_can_create_order(self, gateway_service, web_session):
-        # setup mock products-service response:
-        gateway_service.products_rpc.list.return_value = [
-            {
-                'id': 'the_odyssey',
-                'title': 'The Odyssey',
-                'maximum_speed': 3,
-                'in_stock': 899,
-                'passenger_capacity': 100
-            },
-            {
-                'id': 'the_enigma',
-                'title': 'The Enigma',
-                'maximum_speed': 200,
-                'in_stock': 1,
-                'passenger_capacity': 4
-            },
+    def test_can_list_orders(self, gateway_service, web_session):
+        # setup mock orders-service response:
+        gateway_service.orders_rpc.list_orders.return_value = {
+            'items': [
+                {
+                    'id': 1,
+                    'order_details': [
+                        {
+                            'id': 1,
+                            'quantity': 2,
+                            'product_id': 'the_odyssey',
+                            'price': '200.00'
+                        }
+                    ]
+                }
+            ],
+            'page': 2,
+            'per_page': 1,
+            'total': 2
+        }
+
+        response = web_session.get('/orders?page=2&per_page=1')
+        assert response.status_code == 200
+        assert response.json() == {
+            'items': [
+                {
+                    'id': 1,
+                    'order_details': [
+                        {
+                            'id': 1,
+                            'quantity': 2,
+                            'product_id': 'the_odyssey',
+                            'image':
+                                'http://example.com/airship/images/'
+                                'the_odyssey.jpg',
+                            'price': '200.00'
+                        }
+                    ]
+                }
+            ],
+            'page': 2,
+            'per_page': 1,
+            'total': 2
+        }
+        assert gateway_service.orders_rpc.list_orders.call_args_list == [
+            call(page=2, per_page=1)
         ]
 
+    @pytest.mark.parametrize('query', [
+        'page=0', 'per_page=0', 'per_page=101'
+    ])
+    def test_list_orders_fails_with_invalid_paging(
+        self, gateway_service, web_session, query
+    ):
+        response = web_session.get('/orders?{}'.format(query))
+        assert response.status_code == 400
+        assert response.json()['error'] == 'BAD_REQUEST'
+        assert not gateway_service.orders_rpc.list_orders.called
+
+
+class TestCreateOrder(object):
+
+    def test_can_create_order(self, gateway_service, web_session):
         # setup mock create response
         gateway_service.orders_rpc.create_order.return_value = {
             'id': 11,
@@ -220,7 +337,6 @@ class TestCreateOrder(object):
         )
         assert response.status_code == 200
         assert response.json() == {'id': 11}
-        assert gateway_service.products_rpc.list.call_args_list == [call()]
         assert gateway_service.orders_rpc.create_order.call_args_list == [
             call([
                 {'product_id': 'the_odyssey', 'quantity': 3, 'price': '41.00'}
@@ -255,26 +371,33 @@ class TestCreateOrder(object):
         assert response.status_code == 400
         assert response.json()['error'] == 'VALIDATION_ERROR'
 
+    @pytest.mark.parametrize('quantity', [0, -2])
+    def test_create_order_fails_with_invalid_quantity(
+        self, gateway_service, web_session, quantity
+    ):
+        # call the gateway service to create the order
+        response = web_session.post(
+            '/orders',
+            json.dumps({
+                'order_details': [
+                    {
+                        'product_id': 'the_odyssey',
+                        'price': '41.00',
+                        'quantity': quantity
+                    }
+                ]
+            })
+        )
+        assert response.status_code == 400
+        assert response.json()['error'] == 'VALIDATION_ERROR'
+        assert not gateway_service.orders_rpc.create_order.called
+
     def test_create_order_fails_with_unknown_product(
         self, gateway_service, web_session
     ):
-        # setup mock products-service response:
-        gateway_service.products_rpc.list.return_value = [
-            {
-                'id': 'the_odyssey',
-                'title': 'The Odyssey',
-                'maximum_speed': 3,
-                'in_stock': 899,
-                'passenger_capacity': 100
-            },
-            {
-                'id': 'the_enigma',
-                'title': 'The Enigma',
-                'maximum_speed': 200,
-                'in_stock': 1,
-                'passenger_capacity': 4
-            },
-        ]
+        # setup mock orders-service response:
+        gateway_service.orders_rpc.create_order.side_effect = (
+            ProductNotFound('Product Id unknown'))
 
         # call the gateway service to create the order
         response = web_session.post(
@@ -292,3 +415,27 @@ class TestCreateOrder(object):
         assert response.status_code == 404
         assert response.json()['error'] == 'PRODUCT_NOT_FOUND'
         assert response.json()['message'] == 'Product Id unknown'
+
+    def test_create_order_fails_when_not_in_stock(
+        self, gateway_service, web_session
+    ):
+        # setup mock orders-service response:
+        gateway_service.orders_rpc.create_order.side_effect = (
+            ProductNotInStock('Product Id the_enigma'))
+
+        # call the gateway service to create the order
+        response = web_session.post(
+            '/orders',
+            json.dumps({
+                'order_details': [
+                    {
+                        'product_id': 'the_enigma',
+                        'price': '41',
+                        'quantity': 2
+                    }
+                ]
+            })
+        )
+        assert response.status_code == 409
+        assert response.json()['error'] == 'PRODUCT_NOT_IN_STOCK'
+        assert response.json()['message'] == 'Product Id the_enigma'
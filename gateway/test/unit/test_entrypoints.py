@@ -3,7 +3,9 @@ import pytest
 from marshmallow import ValidationError
 
 from gateway.entrypoints import HttpEntrypoint
-from gateway.exceptions import ProductNotFound, OrderNotFound
+from gateway.exceptions import (
+    ProductExists, ProductNotFound, ProductNotInStock, OrderNotFound
+)
 
 
 class TestHttpEntrypoint(object):
@@ -14,6 +16,10 @@ class TestHttpEntrypoint(object):
             (ValueError('unexpected'), 'UNEXPECTED_ERROR', 500, 'unexpected'),
             (ValidationError('v1'), 'VALIDATION_ERROR', 400, 'v1'),
             (ProductNotFound('p1'), 'PRODUCT_NOT_FOUND', 404, 'p1'),
+            (
+                ProductNotInStock('p2'), 'PRODUCT_NOT_IN_STOCK', 409, 'p2'
+            ),
+            (ProductExists('p3'), 'PRODUCT_EXISTS', 409, 'p3'),
             (OrderNotFound('o1'), 'ORDER_NOT_FOUND', 404, 'o1'),
             (TypeError('t1'), 'BAD_REQUEST', 400, 't1'),
         ]
@@ -25,6 +31,8 @@ class TestHttpEntrypoint(object):
         entrypoint.expected_exceptions = (
             ValidationError,
             ProductNotFound,
+            ProductNotInStock,
+            ProductExists,
             OrderNotFound,
             TypeError,
         )
@@ -1,2 +1,37 @@
+from nameko.exceptions import registry
+
+
+def remote_error(exc_path):
+    """
+    Decorator that registers remote exception with matching ``exc_path``
+    to be deserialized to decorated exception instance, rather than
+    wrapped in ``RemoteError``.
+    """
+
+    def wrapper(exc_type):
+        registry[exc_path] = exc_type
+        return exc_type
+
+    return wrapper
+
+
 class NotFound(Exception):
     pass
+
+
+@remote_error('products.exceptions.NotFound')
+class ProductNotFound(Exception):
+    pass
+
+
+@remote_error('products.exceptions.OutOfStock')
+class ProductNotInStock(Exception):
+    pass
+
+
+class InvalidPagination(Exception):
+    pass
+
+
+class StockAlreadyReserved(Exception):
+    pass
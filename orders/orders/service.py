@@ -1,43 +1,103 @@
 from nameko.events import EventDispatcher
-from nameko.rpc import rpc
+from nameko.rpc import RpcProxy, rpc
 from nameko_sqlalchemy import DatabaseSession
+from sqlalchemy.orm import joinedload, selectinload
 
-from orders.exceptions import NotFound
+from orders.exceptions import (
+    InvalidPagination, NotFound, StockAlreadyReserved
+)
 from orders.models import DeclarativeBase, Order, OrderDetail
 from orders.schemas import OrderSchema
 
 
+# Schemas are built once, rather than walking their declared fields again on
+# every call; the `many` variant has its list handling set up at construction.
+_ORDER_SCHEMA = OrderSchema()
+_ORDER_SCHEMA_MANY = OrderSchema(many=True)
+
+
 class OrdersService:
     name = 'orders'
 
     db = DatabaseSession(DeclarativeBase)
     event_dispatcher = EventDispatcher()
+    products_rpc = RpcProxy('products')
 
     @rpc
     def get_order(self, order_id):
-        order = self.db.query(Order).get(order_id)
+        order = self._get_order(order_id)
 
         if not order:
             raise NotFound('Order with id {} not found'.format(order_id))
 
-        return OrderSchema().dump(order).data
+        return _ORDER_SCHEMA.dump(order).data
 
     @rpc
-    def create_order(self, order_details):
-        order = Order(
-            order_details=[
-                OrderDetail(
-                    product_id=order_detail['product_id'],
-                    price=order_detail['price'],
-                    quantity=order_detail['quantity']
-                )
-                for order_detail in order_details
-            ]
+    def list_orders(self, page=1, per_page=50):
+        if page < 1 or per_page < 1:
+            raise InvalidPagination(
+                'Invalid page {} or page size {}'.format(page, per_page))
+
+        query = self.db.query(Order)
+        total = query.count()
+
+        # order details are fetched with a single extra query for the whole
+        # page, rather than one query per order when they are serialized
+        orders = (
+            query
+            .options(selectinload(Order.order_details))
+            .order_by(Order.id)
+            .limit(per_page)
+            .offset((page - 1) * per_page)
+            .all()
         )
+
+        return {
+            'items': _ORDER_SCHEMA_MANY.dump(orders).data,
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+        }
+
+    @rpc
+    def create_order(self, order_details):
+        order = Order()
         self.db.add(order)
-        self.db.commit()
+        self.db.flush()
+        order_id = order.id
+
+        # take the stock for the whole order in one atomic step before
+        # inserting its details; the order is rolled back if this fails
+        # Note - this may raise `ProductNotFound` or `ProductNotInStock`
+        if not self.products_rpc.reserve_stock(order_details, order_id):
+            # products remembers this id from an earlier order, e.g. one
+            # lost with a database reset, so no stock was taken for it
+            raise StockAlreadyReserved(
+                'Stock for order {} was already reserved'.format(order_id))
+
+        try:
+            # insert all order details with a single multi-row statement
+            # rather than one INSERT per detail from the unit of work
+            if order_details:
+                self.db.execute(
+                    OrderDetail.__table__.insert(),
+                    [
+                        {
+                            'order_id': order_id,
+                            'product_id': order_detail['product_id'],
+                            'price': order_detail['price'],
+                            'quantity': order_detail['quantity'],
+                        }
+                        for order_detail in order_details
+                    ]
+                )
+            self.db.commit()
+        except Exception:
+            # the order is rolled back, so give its stock back too
+            self.products_rpc.release_stock(order_id)
+            raise
 
-        order = OrderSchema().dump(order).data
+        order = _ORDER_SCHEMA.dump(self._get_order(order_id)).data
 
         self.event_dispatcher('order_created', {
             'order': order,
@@ -47,22 +107,41 @@ class OrdersService:
 
     @rpc
     def update_order(self, order):
+        order_obj = self._get_order(order['id'])
+
+        if not order_obj:
+            raise NotFound('Order with id {} not found'.format(order['id']))
+
         order_details = {
             order_details['id']: order_details
             for order_details in order['order_details']
         }
 
-        order = self.db.query(Order).get(order['id'])
-
-        for order_detail in order.order_details:
+        for order_detail in order_obj.order_details:
             order_detail.price = order_details[order_detail.id]['price']
             order_detail.quantity = order_details[order_detail.id]['quantity']
 
         self.db.commit()
-        return OrderSchema().dump(order).data
+        return _ORDER_SCHEMA.dump(order_obj).data
 
     @rpc
     def delete_order(self, order_id):
         order = self.db.query(Order).get(order_id)
+
+        if not order:
+            raise NotFound('Order with id {} not found'.format(order_id))
+
         self.db.delete(order)
         self.db.commit()
+
+    def _get_order(self, order_id):
+        # join the order details onto the order query, so serializing them
+        # does not issue a second query. `populate_existing` makes this hold
+        # for orders already in the session too, which would otherwise be
+        # refreshed without their details.
+        return (
+            self.db.query(Order)
+            .options(joinedload(Order.order_details))
+            .populate_existing()
+            .get(order_id)
+        )
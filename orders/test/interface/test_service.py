@@ -3,6 +3,7 @@ import pytest
 from mock import call
 from nameko.exceptions import RemoteError
 
+from orders.exceptions import ProductNotFound, ProductNotInStock
 from orders.models import Order, OrderDetail
 from orders.schemas import OrderSchema, OrderDetailSchema
 
@@ -41,6 +42,36 @@ def test_will_raise_when_order_not_found(orders_rpc):
     assert err.value.value == 'Order with id 1 not found'
 
 
+def test_list_orders(orders_rpc, db_session):
+    db_session.add_all([Order() for _ in range(3)])
+    db_session.commit()
+
+    response = orders_rpc.list_orders(page=2, per_page=2)
+
+    assert response['page'] == 2
+    assert response['per_page'] == 2
+    assert response['total'] == 3
+    assert [order['id'] for order in response['items']] == [3]
+
+
+@pytest.mark.usefixtures('db_session')
+@pytest.mark.parametrize('paging', [
+    {'page': 0}, {'per_page': 0}, {'page': -1, 'per_page': 10}
+])
+def test_list_orders_fails_with_invalid_paging(orders_rpc, paging):
+    with pytest.raises(RemoteError) as err:
+        orders_rpc.list_orders(**paging)
+    assert err.value.exc_type == 'InvalidPagination'
+
+
+@pytest.mark.usefixtures('db_session', 'order_details')
+def test_list_orders_includes_order_details(orders_rpc, order):
+    response = orders_rpc.list_orders()
+
+    assert response['total'] == 1
+    assert response['items'] == [OrderSchema().dump(order).data]
+
+
 @pytest.mark.usefixtures('db_session')
 def test_can_create_order(orders_service, orders_rpc):
     order_details = [
@@ -55,11 +86,13 @@ def test_can_create_order(orders_service, orders_rpc):
             'quantity': 8
         }
     ]
-    new_order = orders_rpc.create_order(
-        OrderDetailSchema(many=True).dump(order_details).data
-    )
+    payload = OrderDetailSchema(many=True).dump(order_details).data
+    new_order = orders_rpc.create_order(payload)
     assert new_order['id'] > 0
     assert len(new_order['order_details']) == len(order_details)
+    assert [call(payload, new_order['id'])] == (
+        orders_service.products_rpc.reserve_stock.call_args_list)
+    assert not orders_service.products_rpc.release_stock.called
     assert [call(
         'order_created', {'order': {
             'id': 1,
@@ -80,6 +113,68 @@ def test_can_create_order(orders_service, orders_rpc):
     )] == orders_service.event_dispatcher.call_args_list
 
 
+def test_create_order_fails_with_unknown_product(
+    orders_service, orders_rpc, db_session
+):
+    orders_service.products_rpc.reserve_stock.side_effect = (
+        ProductNotFound('Product ID unknown does not exist'))
+    with pytest.raises(RemoteError) as err:
+        orders_rpc.create_order(
+            [{'product_id': 'unknown', 'price': '41', 'quantity': 1}]
+        )
+    assert err.value.exc_type == 'ProductNotFound'
+    assert err.value.value == 'Product ID unknown does not exist'
+    assert not orders_service.event_dispatcher.called
+    assert db_session.query(Order).count() == 0
+
+
+def test_create_order_fails_when_not_in_stock(
+    orders_service, orders_rpc, db_session
+):
+    orders_service.products_rpc.reserve_stock.side_effect = (
+        ProductNotInStock('Not enough stock for product the_enigma'))
+    with pytest.raises(RemoteError) as err:
+        orders_rpc.create_order(
+            [{'product_id': 'the_enigma', 'price': '41', 'quantity': 2}]
+        )
+    assert err.value.exc_type == 'ProductNotInStock'
+    assert err.value.value == 'Not enough stock for product the_enigma'
+    assert not orders_service.event_dispatcher.called
+    assert db_session.query(Order).count() == 0
+
+
+def test_create_order_fails_when_stock_already_reserved(
+    orders_service, orders_rpc, db_session
+):
+    orders_service.products_rpc.reserve_stock.return_value = False
+    with pytest.raises(RemoteError) as err:
+        orders_rpc.create_order(
+            [{'product_id': 'the_enigma', 'price': '41', 'quantity': 2}]
+        )
+    assert err.value.exc_type == 'StockAlreadyReserved'
+    assert err.value.value == 'Stock for order 1 was already reserved'
+    assert not orders_service.event_dispatcher.called
+    assert db_session.query(Order).count() == 0
+
+
+def test_create_order_releases_stock_when_insert_fails(
+    orders_service, orders_rpc, db_session
+):
+    # a detail without a price fails the insert, after the stock was taken
+    with pytest.raises(RemoteError) as err:
+        orders_rpc.create_order(
+            [{'product_id': 'the_enigma', 'price': None, 'quantity': 2}]
+        )
+    assert err.value.exc_type == 'IntegrityError'
+    assert [call([
+        {'product_id': 'the_enigma', 'price': None, 'quantity': 2}
+    ], 1)] == orders_service.products_rpc.reserve_stock.call_args_list
+    assert [call(1)] == (
+        orders_service.products_rpc.release_stock.call_args_list)
+    assert not orders_service.event_dispatcher.called
+    assert db_session.query(Order).count() == 0
+
+
 @pytest.mark.usefixtures('db_session', 'order_details')
 def test_can_update_order(orders_rpc, order):
     order_payload = OrderSchema().dump(order).data
@@ -91,6 +186,20 @@ def test_can_update_order(orders_rpc, order):
     assert updated_order['order_details'] == order_payload['order_details']
 
 
+@pytest.mark.usefixtures('db_session')
+def test_will_raise_when_updating_missing_order(orders_rpc):
+    with pytest.raises(RemoteError) as err:
+        orders_rpc.update_order({'id': 1, 'order_details': []})
+    assert err.value.value == 'Order with id 1 not found'
+
+
 def test_can_delete_order(orders_rpc, order, db_session):
     orders_rpc.delete_order(order.id)
     assert not db_session.query(Order).filter_by(id=order.id).count()
+
+
+@pytest.mark.usefixtures('db_session')
+def test_will_raise_when_deleting_missing_order(orders_rpc):
+    with pytest.raises(RemoteError) as err:
+        orders_rpc.delete_order(1)
+    assert err.value.value == 'Order with id 1 not found'
@@ -1,11 +1,171 @@
+from itertools import chain, islice
+import socket
+from types import SimpleNamespace
+import zlib
+
+from eventlet import GreenPool
 from nameko import config
 from nameko.extensions import DependencyProvider
+import lz4.frame
+import msgpack
 import redis
 
-from products.exceptions import NotFound
+from products.exceptions import (
+    InvalidQuantity, NotFound, OutOfStock, ProductExists
+)
 
 
 REDIS_URI_KEY = 'REDIS_URI'
+REDIS_POOL_SIZE_KEY = 'REDIS_POOL_SIZE'
+REDIS_POOL_TIMEOUT_KEY = 'REDIS_POOL_TIMEOUT'
+
+# Idle seconds before TCP keepalive probes are sent on pooled connections
+KEEPALIVE_IDLE = 60
+
+# Number of products fetched per round-trip when listing
+LIST_BATCH_SIZE = 256
+
+# Product documents packing to at least this many bytes are stored lz4
+# compressed. Smaller ones would barely shrink, so they are stored as is.
+COMPRESS_MIN_SIZE = 512
+
+# Leading bytes of an lz4 frame. Packed documents are msgpack maps, which
+# never start with these, so compressed documents can be told apart.
+LZ4_FRAME_MAGIC = b'\x04\x22\x4d\x18'
+
+# Product ids are spread over this many sets, so `list` can fetch the
+# shards concurrently
+PRODUCT_ID_SHARDS = 16
+
+# Stock levels of all products, keyed by product id. Stock is kept apart
+# from the product documents so it can be changed in place with HINCRBY.
+STOCK_KEY = 'products_stock'
+
+# Aggregates kept up to date by the scripts below: the total stock across
+# all products, and the set of ids of products that are out of stock.
+STOCK_TOTAL_KEY = 'stock:total'
+OUT_OF_STOCK_KEY = 'stock:zero'
+
+# Stores the product document and its stock only when the product does not
+# exist yet. KEYS are the product key, `STOCK_KEY`, the id set shard,
+# `STOCK_TOTAL_KEY` and `OUT_OF_STOCK_KEY`, ARGV the product id, the packed
+# document and the stock. Returns 1 when created, 0 otherwise.
+CREATE_PRODUCT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+redis.call('SADD', KEYS[3], ARGV[1])
+redis.call('INCRBY', KEYS[4], ARGV[3])
+if tonumber(ARGV[3]) == 0 then
+    redis.call('SADD', KEYS[5], ARGV[1])
+end
+return 1
+"""
+
+# Seconds an order is remembered after its stock was decremented, so a
+# retried reservation does not decrement it again. The order's seen key
+# holds the amount taken for each product, so the stock can be released.
+ORDER_SEEN_TTL = 86400
+
+# Decrements the stock in `STOCK_KEY` of every product id in ARGV by the
+# amount following it, but only if all of them have enough stock. KEYS are
+# `STOCK_KEY`, `STOCK_TOTAL_KEY`, `OUT_OF_STOCK_KEY` and optionally the
+# order's seen key, ARGV the seen key ttl followed by the id/amount pairs.
+# Returns 1 when the stock was decremented, 0 when the order was seen
+# already, or a `{reason, product_id}` pair for the first product with an
+# 'invalid' amount, or that is 'missing' or 'short' of stock.
+DECREMENT_STOCK_SCRIPT = """
+if KEYS[4] and redis.call('EXISTS', KEYS[4]) == 1 then
+    return 0
+end
+local needed = {}
+for i = 2, #ARGV, 2 do
+    local amount = tonumber(ARGV[i + 1])
+    if not amount or amount <= 0 then
+        return {'invalid', ARGV[i]}
+    end
+    needed[ARGV[i]] = (needed[ARGV[i]] or 0) + amount
+end
+for product_id, amount in pairs(needed) do
+    local in_stock = tonumber(redis.call('HGET', KEYS[1], product_id))
+    if not in_stock then
+        return {'missing', product_id}
+    end
+    if in_stock < amount then
+        return {'short', product_id}
+    end
+end
+for i = 2, #ARGV, 2 do
+    local amount = tonumber(ARGV[i + 1])
+    if redis.call('HINCRBY', KEYS[1], ARGV[i], -amount) == 0 then
+        redis.call('SADD', KEYS[3], ARGV[i])
+    end
+    redis.call('DECRBY', KEYS[2], amount)
+end
+if KEYS[4] then
+    for product_id, amount in pairs(needed) do
+        redis.call('HSET', KEYS[4], product_id, amount)
+    end
+    redis.call('EXPIRE', KEYS[4], ARGV[1])
+end
+return 1
+"""
+
+# Gives back the stock an order took, as recorded in its seen key, and
+# forgets the order. KEYS are `STOCK_KEY`, `STOCK_TOTAL_KEY`,
+# `OUT_OF_STOCK_KEY` and the order's seen key. Returns the ids of the
+# products released.
+RELEASE_STOCK_SCRIPT = """
+if redis.call('TYPE', KEYS[4]).ok ~= 'hash' then
+    return {}
+end
+local reserved = redis.call('HGETALL', KEYS[4])
+local released = {}
+for i = 1, #reserved, 2 do
+    local amount = tonumber(reserved[i + 1])
+    if redis.call('HINCRBY', KEYS[1], reserved[i], amount) > 0 then
+        redis.call('SREM', KEYS[3], reserved[i])
+    end
+    redis.call('INCRBY', KEYS[2], amount)
+    released[#released + 1] = reserved[i]
+end
+redis.call('DEL', KEYS[4])
+return released
+"""
+
+
+def product_key(product_id):
+    """ Key of the packed document of `product_id` """
+    return 'products:{}'.format(product_id)
+
+
+def pack_product(product):
+    """ Pack `product` into the document stored at its key
+
+    The stock is left out, as it is kept in `STOCK_KEY`.
+    """
+    document = product.copy()
+    document.pop('in_stock', None)
+    packed = msgpack.packb(document, use_bin_type=True)
+    if len(packed) >= COMPRESS_MIN_SIZE:
+        packed = lz4.frame.compress(packed)
+    return packed
+
+
+def _order_seen_key(order_id):
+    return 'orders:seen:{}'.format(order_id)
+
+
+def product_ids_key(product_id):
+    """ Key of the id set shard holding `product_id` """
+    shard = zlib.crc32(str(product_id).encode('utf-8')) % PRODUCT_ID_SHARDS
+    return _product_ids_shard_key(shard)
+
+
+def _product_ids_shard_key(shard):
+    return 'product_ids:{:x}'.format(shard)
 
 
 class StorageWrapper:
@@ -19,49 +179,159 @@ class StorageWrapper:
 
     """
 
+    InvalidQuantity = InvalidQuantity
     NotFound = NotFound
+    OutOfStock = OutOfStock
+    ProductExists = ProductExists
 
-    def __init__(self, client):
+    def __init__(self, client, scripts):
         self.client = client
+        self.scripts = scripts
 
-    def _format_key(self, product_id):
-        return 'products:{}'.format(product_id)
-
-    def _from_hash(self, document):
-        return {
-            'id': document[b'id'].decode('utf-8'),
-            'title': document[b'title'].decode('utf-8'),
-            'passenger_capacity': int(document[b'passenger_capacity']),
-            'maximum_speed': int(document[b'maximum_speed']),
-            'in_stock': int(document[b'in_stock'])
-        }
+    def _unpack(self, document, in_stock):
+        if document.startswith(LZ4_FRAME_MAGIC):
+            document = lz4.frame.decompress(document)
+        product = msgpack.unpackb(document, raw=False)
+        product['in_stock'] = int(in_stock)
+        return product
 
     def get(self, product_id):
-        product = self.client.hgetall(self._format_key(product_id))
-        if not product:
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(product_key(product_id))
+        pipe.hget(STOCK_KEY, product_id)
+        document, in_stock = pipe.execute()
+        if document is None:
             raise NotFound('Product ID {} does not exist'.format(product_id))
         else:
-            return self._from_hash(product)
+            return self._unpack(document, in_stock)
+
+    def get_many(self, product_ids):
+        if not product_ids:
+            return []
+        pipe = self.client.pipeline(transaction=False)
+        pipe.mget([product_key(product_id) for product_id in product_ids])
+        pipe.hmget(STOCK_KEY, product_ids)
+        documents, stock = pipe.execute()
+        return [
+            self._unpack(document, in_stock)
+            for document, in_stock in zip(documents, stock) if document
+        ]
 
     def list(self):
-        keys = self.client.keys(self._format_key('*'))
-        for key in keys:
-            yield self._from_hash(self.client.hgetall(key))
+        pool = GreenPool(PRODUCT_ID_SHARDS)
+        shards = pool.imap(self._list_shard, range(PRODUCT_ID_SHARDS))
+        return chain.from_iterable(shards)
+
+    def _list_shard(self, shard):
+        product_ids = iter(
+            self.client.smembers(_product_ids_shard_key(shard)))
+        products = []
+        while True:
+            batch = list(islice(product_ids, LIST_BATCH_SIZE))
+            if not batch:
+                return products
+            pipe = self.client.pipeline(transaction=False)
+            pipe.mget([
+                product_key(product_id.decode('utf-8'))
+                for product_id in batch
+            ])
+            pipe.hmget(STOCK_KEY, batch)
+            documents, stock = pipe.execute()
+            products.extend(
+                self._unpack(document, in_stock)
+                for document, in_stock in zip(documents, stock) if document
+            )
 
     def create(self, product):
-        self.client.hmset(
-            self._format_key(product['id']),
-            product)
+        created = self.scripts.create_product(
+            keys=[
+                product_key(product['id']), STOCK_KEY,
+                product_ids_key(product['id']), STOCK_TOTAL_KEY,
+                OUT_OF_STOCK_KEY
+            ],
+            args=[product['id'], pack_product(product), product['in_stock']])
+        if not created:
+            raise ProductExists(
+                'Product ID {} already exists'.format(product['id']))
+
+    def decrement_stock_many(self, items, order_id=None):
+        """ Atomically decrement stock for `(product_id, amount)` pairs
+
+        Nothing is decremented unless every amount is positive and every
+        product exists and has enough stock. When `order_id` is given,
+        stock is decremented at most once for that order; returns False if
+        it already was.
+        """
+        keys = [STOCK_KEY, STOCK_TOTAL_KEY, OUT_OF_STOCK_KEY]
+        if order_id is not None:
+            keys.append(_order_seen_key(order_id))
+        args = [ORDER_SEEN_TTL]
+        args.extend(item for pair in items for item in pair)
+        result = self.scripts.decrement_stock(keys=keys, args=args)
+        if isinstance(result, list):
+            reason, product_id = (value.decode('utf-8') for value in result)
+            if reason == 'invalid':
+                raise InvalidQuantity(
+                    'Invalid quantity for product {}'.format(product_id))
+            if reason == 'missing':
+                raise NotFound(
+                    'Product ID {} does not exist'.format(product_id))
+            raise OutOfStock(
+                'Not enough stock for product {}'.format(product_id))
+        return bool(result)
 
-    def decrement_stock(self, product_id, amount):
-        return self.client.hincrby(
-            self._format_key(product_id), 'in_stock', -amount)
+    def release_stock(self, order_id):
+        """ Give back the stock taken for `order_id` by
+        `decrement_stock_many`, returning the ids of the products released
+
+        Nothing is released when no stock was taken for the order, or it
+        was released already.
+        """
+        released = self.scripts.release_stock(keys=[
+            STOCK_KEY, STOCK_TOTAL_KEY, OUT_OF_STOCK_KEY,
+            _order_seen_key(order_id)
+        ])
+        return [product_id.decode('utf-8') for product_id in released]
+
+    def get_stock_summary(self):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(STOCK_TOTAL_KEY)
+        pipe.scard(OUT_OF_STOCK_KEY)
+        total_in_stock, out_of_stock = pipe.execute()
+        return {
+            'total_in_stock': int(total_in_stock or 0),
+            'skus_out_of_stock': out_of_stock,
+        }
 
 
 class Storage(DependencyProvider):
 
     def setup(self):
-        self.client = redis.StrictRedis.from_url(config.get(REDIS_URI_KEY))
+        keepalive_options = {}
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            keepalive_options[socket.TCP_KEEPIDLE] = KEEPALIVE_IDLE
+        # workers wait up to the pool timeout for a free connection rather
+        # than failing once the pool is exhausted
+        pool = redis.BlockingConnectionPool.from_url(
+            config.get(REDIS_URI_KEY),
+            max_connections=config.get(REDIS_POOL_SIZE_KEY, 200),
+            timeout=config.get(REDIS_POOL_TIMEOUT_KEY, 5),
+            socket_keepalive=True,
+            socket_keepalive_options=keepalive_options,
+        )
+        self.client = redis.StrictRedis(connection_pool=pool)
+        self.scripts = SimpleNamespace(
+            create_product=self.client.register_script(CREATE_PRODUCT_SCRIPT),
+            decrement_stock=self.client.register_script(
+                DECREMENT_STOCK_SCRIPT),
+            release_stock=self.client.register_script(RELEASE_STOCK_SCRIPT),
+        )
+
+    def stop(self):
+        self.client.connection_pool.disconnect()
+
+    def kill(self):
+        self.client.connection_pool.disconnect()
 
     def get_dependency(self, worker_ctx):
-        return StorageWrapper(self.client)
+        return StorageWrapper(self.client, self.scripts)
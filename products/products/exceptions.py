@@ -1,2 +1,14 @@
 class NotFound(Exception):
     pass
+
+
+class ProductExists(Exception):
+    pass
+
+
+class OutOfStock(Exception):
+    pass
+
+
+class InvalidQuantity(Exception):
+    pass
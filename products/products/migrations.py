@@ -0,0 +1,80 @@
+""" One-off migration of products stored as Redis hashes
+
+Earlier versions stored each product as a hash at `products:{id}`. This
+rewrites them in the current layout: a packed document at the same key,
+the stock in `STOCK_KEY`, the id in its id set shard, and the stock
+aggregates. Products already migrated are left alone, so it is safe to run
+more than once, and from several replicas at once. Run it from the service
+directory before starting the service ::
+
+    python -m products.migrations config.yml
+
+"""
+import sys
+
+from nameko.cli.utils.config import load_config
+import redis
+
+from products.dependencies import (
+    LIST_BATCH_SIZE, OUT_OF_STOCK_KEY, REDIS_URI_KEY, STOCK_KEY,
+    STOCK_TOTAL_KEY, pack_product, product_ids_key, product_key
+)
+
+
+def _from_hash(document):
+    return {
+        'id': document[b'id'].decode('utf-8'),
+        'title': document[b'title'].decode('utf-8'),
+        'passenger_capacity': int(document[b'passenger_capacity']),
+        'maximum_speed': int(document[b'maximum_speed']),
+        'in_stock': int(document[b'in_stock'])
+    }
+
+
+def migrate_product(client, key):
+    """ Migrate the product at `key` if it is still stored as a hash,
+    returning whether it was migrated
+    """
+    def migrate_hash(pipe):
+        if pipe.type(key) != b'hash':
+            return False
+        product = _from_hash(pipe.hgetall(key))
+
+        # the product is rewritten in a single transaction, so an
+        # interrupted run leaves no product half migrated
+        pipe.multi()
+        pipe.delete(key)
+        pipe.set(key, pack_product(product))
+        pipe.hset(STOCK_KEY, product['id'], product['in_stock'])
+        pipe.sadd(product_ids_key(product['id']), product['id'])
+        pipe.incrby(STOCK_TOTAL_KEY, product['in_stock'])
+        if product['in_stock'] <= 0:
+            pipe.sadd(OUT_OF_STOCK_KEY, product['id'])
+        return True
+
+    # the key is watched from the type check on, so when another run
+    # migrates the product first the transaction is retried, and then
+    # finds the product migrated already
+    return client.transaction(migrate_hash, key, value_from_callable=True)
+
+
+def migrate(client):
+    """ Migrate every product still stored as a hash, returning how many
+    were migrated
+    """
+    keys = client.scan_iter(match=product_key('*'), count=LIST_BATCH_SIZE)
+    return sum(migrate_product(client, key) for key in keys)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    config_path = argv[0] if argv else 'config.yml'
+    with open(config_path) as config_file:
+        settings = load_config(config_file)
+
+    client = redis.StrictRedis.from_url(settings[REDIS_URI_KEY])
+    print('Migrated {} products'.format(migrate(client)))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
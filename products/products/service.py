@@ -1,13 +1,62 @@
 import logging
 
-from nameko.events import event_handler
+from cachetools import TTLCache
+from marshmallow import fields
+from nameko.events import BROADCAST, event_handler
 from nameko.rpc import rpc
 
 from products import dependencies, schemas
+from products.exceptions import InvalidQuantity
 
 
 logger = logging.getLogger(__name__)
 
+_PRODUCT_LOAD = schemas.Product(strict=True)
+
+# Python type loaded by each kind of field declared on `schemas.Product`
+_LOADED_TYPES = {fields.String: str, fields.Integer: int}
+
+# Type of each product field, read off the schema once so the projections
+# below stay in step with it
+_PRODUCT_FIELD_TYPES = {
+    name: _LOADED_TYPES[type(field)]
+    for name, field in _PRODUCT_LOAD.fields.items()
+}
+_PRODUCT_FIELDS = tuple(_PRODUCT_FIELD_TYPES)
+
+
+def _dump_product(product):
+    """ Plain dict projection of a stored product, used instead of a
+    schema dump for every product returned
+    """
+    return {field: product[field] for field in _PRODUCT_FIELDS}
+
+
+def _load_product(product):
+    """ Validate and load product data
+
+    Input holding exactly the product fields, with values of exactly the
+    loaded types, would come out of the schema unchanged and is copied
+    as is. Anything else goes through the schema, which raises the
+    `ValidationError` describing what is wrong.
+    """
+    if (
+        isinstance(product, dict) and
+        product.keys() == _PRODUCT_FIELD_TYPES.keys() and
+        all(
+            type(product[field]) is type_
+            for field, type_ in _PRODUCT_FIELD_TYPES.items()
+        )
+    ):
+        return dict(product)
+    return _PRODUCT_LOAD.load(product).data
+
+
+# Dumped products keyed by id, served by `get` without a Redis round-trip.
+# Entries are dropped whenever this worker changes a product; the ttl bounds
+# how long changes made by other workers can go unnoticed.
+_product_cache = TTLCache(maxsize=10000, ttl=10)
+
 
 class ProductsService:
 
@@ -17,21 +66,75 @@ class ProductsService:
 
     @rpc
     def get(self, product_id):
-        product = self.storage.get(product_id)
-        return schemas.Product().dump(product).data
+        dumped = _product_cache.get(product_id)
+        if dumped is None:
+            product = self.storage.get(product_id)
+            dumped = _product_cache[product_id] = _dump_product(product)
+        return dumped
+
+    @rpc
+    def get_many(self, product_ids):
+        products = self.storage.get_many(product_ids)
+        return [_dump_product(product) for product in products]
 
     @rpc
     def list(self):
-        products = self.storage.list()
-        return schemas.Product(many=True).dump(products).data
+        return [_dump_product(product) for product in self.storage.list()]
+
+    @rpc
+    def get_stock_summary(self):
+        return self.storage.get_stock_summary()
 
     @rpc
     def create(self, product):
-        product = schemas.Product(strict=True).load(product).data
+        product = _load_product(product)
         self.storage.create(product)
+        _product_cache.pop(product['id'], None)
+
+    @rpc
+    def reserve_stock(self, order_details, order_id):
+        """ Take the stock for an order's details, all or nothing
+
+        Raises `InvalidQuantity`, `NotFound` or `OutOfStock` without taking
+        any stock when a quantity is negative or a product is unknown or
+        short. Reserving again for the same `order_id` has no effect and
+        returns False; otherwise returns True.
+        """
+        # fold lines for the same product together and drop empty ones
+        totals = {}
+        for product in order_details:
+            if product['quantity'] < 0:
+                raise InvalidQuantity(
+                    'Invalid quantity for product {}'.format(
+                        product['product_id']))
+            if product['quantity']:
+                totals[product['product_id']] = (
+                    totals.get(product['product_id'], 0) +
+                    product['quantity'])
+        if not totals:
+            return True
+        reserved = self.storage.decrement_stock_many(
+            list(totals.items()), order_id=order_id)
+        for product_id in totals:
+            _product_cache.pop(product_id, None)
+        return reserved
+
+    @rpc
+    def release_stock(self, order_id):
+        """ Give back the stock reserved for `order_id`
+
+        Used by orders when an order fails after its stock was reserved.
+        Releasing an order with nothing reserved has no effect.
+        """
+        for product_id in self.storage.release_stock(order_id):
+            _product_cache.pop(product_id, None)
 
-    @event_handler('orders', 'order_created')
+    @event_handler(
+        'orders', 'order_created',
+        handler_type=BROADCAST, reliable_delivery=False)
     def handle_order_created(self, payload):
+        # stock was reserved when the order was created, so only products
+        # cached before then need dropping. The cache is per instance, so
+        # every instance gets the event; one that is down has no cache.
         for product in payload['order']['order_details']:
-            self.storage.decrement_stock(
-                product['product_id'], product['quantity'])
+            _product_cache.pop(product['product_id'], None)
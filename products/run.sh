@@ -12,6 +12,10 @@ until nc -z ${REDIS_HOST} ${REDIS_PORT}; do
     sleep 2
 done
 
+# Migrate products stored by earlier versions
+
+python -m products.migrations config.yml
+
 # Run the service
 
 nameko run --config config.yml products.service --backdoor 3000
@@ -7,9 +7,11 @@ setup(
     description='Store and serve products',
     author='nameko',
     packages=find_packages(exclude=['test', 'test.*']),
-    py_modules=['products'],
     install_requires=[
+        "cachetools==4.2.4",
+        "lz4==4.3.2",
         "marshmallow==2.19.2",
+        "msgpack==1.0.4",
         "nameko==v3.0.0-rc6",
         "redis==3.2.1",
     ],
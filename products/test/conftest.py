@@ -1,8 +1,12 @@
+import msgpack
 import pytest
 import redis
 
 from nameko import config
-from products.dependencies import REDIS_URI_KEY
+from products import service
+from products.dependencies import (
+    REDIS_URI_KEY, STOCK_KEY, product_ids_key
+)
 
 
 @pytest.fixture
@@ -13,6 +17,13 @@ def test_config(rabbit_config):
         yield
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """ Module level caches would otherwise leak products between tests """
+    yield
+    service._product_cache.clear()
+
+
 @pytest.yield_fixture
 def redis_client(test_config):
     client = redis.StrictRedis.from_url(config.get(REDIS_URI_KEY))
@@ -36,13 +47,28 @@ def create_product(redis_client, product):
     def create(**overrides):
         new_product = product.copy()
         new_product.update(**overrides)
-        redis_client.hmset(
+        document = new_product.copy()
+        in_stock = document.pop('in_stock')
+        redis_client.set(
             'products:{}'.format(new_product['id']),
-            new_product)
+            msgpack.packb(document, use_bin_type=True))
+        redis_client.hset(STOCK_KEY, new_product['id'], in_stock)
+        redis_client.sadd(
+            product_ids_key(new_product['id']), new_product['id'])
         return new_product
     return create
 
 
+@pytest.fixture
+def stored_product(redis_client):
+    def load(product_id):
+        document = redis_client.get('products:{}'.format(product_id))
+        product = msgpack.unpackb(document, raw=False)
+        product['in_stock'] = int(redis_client.hget(STOCK_KEY, product_id))
+        return product
+    return load
+
+
 @pytest.fixture
 def products(create_product):
     return [
@@ -2,15 +2,21 @@ import pytest
 from mock import Mock
 
 from nameko import config
-from products.dependencies import Storage
+from products import dependencies
+from products.dependencies import (
+    COMPRESS_MIN_SIZE, LZ4_FRAME_MAGIC, Storage, product_ids_key
+)
 
 
-@pytest.fixture
+@pytest.yield_fixture
 def storage(test_config):
     provider = Storage()
     provider.container = Mock(config=config)
     provider.setup()
-    return provider.get_dependency({})
+    yield provider.get_dependency({})
+    provider.stop()
+    pool = provider.client.connection_pool
+    assert all(connection._sock is None for connection in pool._connections)
 
 
 def test_get_fails_on_not_found(storage):
@@ -28,37 +34,190 @@ def test_get(storage, products):
     assert 11 == product['in_stock']
 
 
+def test_get_many(storage, products):
+    many_products = storage.get_many(['LZ130', 'LZ127'])
+    assert [products[2], products[0]] == many_products
+
+
+def test_get_many_when_empty(storage):
+    assert [] == storage.get_many([])
+
+
+def test_get_many_skips_missing(storage, products):
+    many_products = storage.get_many(['LZ129', 'missing'])
+    assert [products[1]] == many_products
+
+
 def test_list(storage, products):
     listed_products = storage.list()
     assert (
         products == sorted(list(listed_products), key=lambda x: x['id']))
 
 
-def test_create(product, redis_client, storage):
+def test_list_in_batches(storage, create_product, monkeypatch):
+    # all ids in one shard, listed two at a time, so it takes three batches
+    monkeypatch.setattr(dependencies, 'PRODUCT_ID_SHARDS', 1)
+    monkeypatch.setattr(dependencies, 'LIST_BATCH_SIZE', 2)
+    created = [
+        create_product(id='LZ{:03}'.format(index)) for index in range(5)
+    ]
+    pipeline = Mock(wraps=storage.client.pipeline)
+    monkeypatch.setattr(storage.client, 'pipeline', pipeline)
+
+    listed_products = storage.list()
+    assert (
+        created == sorted(list(listed_products), key=lambda x: x['id']))
+    assert 3 == pipeline.call_count
 
-    storage.create(product)
 
-    stored_product = redis_client.hgetall('products:LZ127')
+def test_create(product, redis_client, stored_product, storage):
+
+    storage.create(product)
 
-    assert product['id'] == stored_product[b'id'].decode('utf-8')
-    assert product['title'] == stored_product[b'title'].decode('utf-8')
-    assert product['maximum_speed'] == int(stored_product[b'maximum_speed'])
-    assert product['passenger_capacity'] == (
-        int(stored_product[b'passenger_capacity']))
-    assert product['in_stock'] == int(stored_product[b'in_stock'])
+    assert product == stored_product('LZ127')
+    assert {b'LZ127'} == redis_client.smembers(
+        product_ids_key('LZ127'))
 
 
-def test_decrement_stock(storage, create_product, redis_client):
+def test_decrement_stock_many(storage, create_product, stored_product):
     create_product(id=1, title='LZ 127', in_stock=10)
     create_product(id=2, title='LZ 129', in_stock=11)
     create_product(id=3, title='LZ 130', in_stock=12)
 
-    in_stock = storage.decrement_stock(2, 4)
+    storage.decrement_stock_many([(1, 3), (3, 5)])
 
-    assert 7 == in_stock
     product_one, product_two, product_three = [
-        redis_client.hgetall('products:{}'.format(id_))
-        for id_ in (1, 2, 3)]
-    assert b'10' == product_one[b'in_stock']
-    assert b'7' == product_two[b'in_stock']
-    assert b'12' == product_three[b'in_stock']
+        stored_product(id_) for id_ in (1, 2, 3)]
+    assert 7 == product_one['in_stock']
+    assert 11 == product_two['in_stock']
+    assert 7 == product_three['in_stock']
+
+
+def test_create_fails_when_product_exists(
+    product, create_product, stored_product, storage
+):
+    create_product(title='Original')
+
+    with pytest.raises(storage.ProductExists) as exc:
+        storage.create(product)
+    assert 'Product ID LZ127 already exists' == exc.value.args[0]
+
+    assert 'Original' == stored_product('LZ127')['title']
+
+
+def test_decrement_stock_many_fails_when_out_of_stock(
+    storage, create_product, stored_product
+):
+    create_product(id=1, title='LZ 127', in_stock=10)
+    create_product(id=2, title='LZ 129', in_stock=3)
+
+    with pytest.raises(storage.OutOfStock) as exc:
+        storage.decrement_stock_many([(1, 3), (2, 2), (2, 2)])
+    assert 'Not enough stock for product 2' == exc.value.args[0]
+
+    product_one, product_two = [
+        stored_product(id_) for id_ in (1, 2)]
+    assert 10 == product_one['in_stock']
+    assert 3 == product_two['in_stock']
+
+
+def test_get_stock_summary(storage, product):
+    assert {'total_in_stock': 0, 'skus_out_of_stock': 0} == (
+        storage.get_stock_summary())
+
+    storage.create(dict(product, id='LZ127', in_stock=10))
+    storage.create(dict(product, id='LZ129', in_stock=3))
+    storage.create(dict(product, id='LZ130', in_stock=0))
+    storage.decrement_stock_many([('LZ127', 4), ('LZ129', 3)])
+
+    assert {'total_in_stock': 6, 'skus_out_of_stock': 2} == (
+        storage.get_stock_summary())
+
+
+def test_create_compresses_large_products(product, redis_client, storage):
+    product['title'] = 'LZ 127 Graf Zeppelin ' * COMPRESS_MIN_SIZE
+
+    storage.create(product)
+
+    document = redis_client.get('products:LZ127')
+    assert document.startswith(LZ4_FRAME_MAGIC)
+    assert len(document) < COMPRESS_MIN_SIZE
+    assert product == storage.get('LZ127')
+
+
+def test_decrement_stock_many_once_per_order(
+    storage, create_product, stored_product
+):
+    create_product(id=1, title='LZ 127', in_stock=10)
+
+    assert storage.decrement_stock_many([(1, 3)], order_id=7)
+    assert not storage.decrement_stock_many([(1, 3)], order_id=7)
+    assert storage.decrement_stock_many([(1, 3)], order_id=8)
+
+    assert 4 == stored_product(1)['in_stock']
+
+
+def test_release_stock(storage, product):
+    storage.create(dict(product, id='LZ127', in_stock=10))
+    storage.create(dict(product, id='LZ129', in_stock=3))
+    storage.decrement_stock_many(
+        [('LZ127', 4), ('LZ129', 3), ('LZ127', 1)], order_id=7)
+
+    assert ['LZ127', 'LZ129'] == sorted(storage.release_stock(7))
+
+    assert 10 == storage.get('LZ127')['in_stock']
+    assert 3 == storage.get('LZ129')['in_stock']
+    assert {'total_in_stock': 13, 'skus_out_of_stock': 0} == (
+        storage.get_stock_summary())
+    assert [] == storage.release_stock(7)
+    assert storage.decrement_stock_many([('LZ129', 1)], order_id=7)
+
+
+def test_release_stock_when_nothing_reserved(storage, product):
+    storage.create(dict(product, id='LZ127', in_stock=10))
+
+    assert [] == storage.release_stock(7)
+
+    assert 10 == storage.get('LZ127')['in_stock']
+
+
+def test_decrement_stock_many_fails_on_not_found(
+    storage, create_product, stored_product
+):
+    create_product(id=1, title='LZ 127', in_stock=10)
+
+    with pytest.raises(storage.NotFound) as exc:
+        storage.decrement_stock_many([(1, 3), ('missing', 1)])
+    assert 'Product ID missing does not exist' == exc.value.args[0]
+
+    assert 10 == stored_product(1)['in_stock']
+
+
+@pytest.mark.parametrize('amount', [0, -2])
+def test_decrement_stock_many_fails_on_invalid_amount(
+    storage, create_product, stored_product, amount
+):
+    create_product(id=1, title='LZ 127', in_stock=10)
+    create_product(id=2, title='LZ 129', in_stock=3)
+
+    with pytest.raises(storage.InvalidQuantity) as exc:
+        storage.decrement_stock_many([(1, 3), (2, amount)])
+    assert 'Invalid quantity for product 2' == exc.value.args[0]
+
+    product_one, product_two = [
+        stored_product(id_) for id_ in (1, 2)]
+    assert 10 == product_one['in_stock']
+    assert 3 == product_two['in_stock']
+    assert 0 == storage.get_stock_summary()['total_in_stock']
+
+
+def test_kill_disconnects_pool(test_config):
+    provider = Storage()
+    provider.container = Mock(config=config)
+    provider.setup()
+    provider.client.ping()
+
+    provider.kill()
+
+    pool = provider.client.connection_pool
+    assert all(connection._sock is None for connection in pool._connections)
@@ -0,0 +1,71 @@
+from nameko import config
+
+from products import migrations
+from products.dependencies import (
+    OUT_OF_STOCK_KEY, REDIS_URI_KEY, STOCK_KEY, STOCK_TOTAL_KEY,
+    product_ids_key
+)
+from products.migrations import main, migrate, migrate_product
+
+
+def store_hash(redis_client, product):
+    redis_client.hmset('products:{}'.format(product['id']), product)
+
+
+def test_migrate(product, redis_client, stored_product):
+    store_hash(redis_client, product)
+    store_hash(redis_client, dict(product, id='LZ129', in_stock=0))
+
+    assert 2 == migrate(redis_client)
+
+    assert product == stored_product('LZ127')
+    assert 0 == stored_product('LZ129')['in_stock']
+    assert {b'LZ127'} == redis_client.smembers(product_ids_key('LZ127'))
+    assert {b'LZ129'} == redis_client.smembers(product_ids_key('LZ129'))
+    assert b'11' == redis_client.get(STOCK_TOTAL_KEY)
+    assert {b'LZ129'} == redis_client.smembers(OUT_OF_STOCK_KEY)
+
+
+def test_migrate_skips_migrated_products(
+    product, create_product, redis_client, stored_product
+):
+    create_product()
+
+    assert 0 == migrate(redis_client)
+    assert product == stored_product('LZ127')
+
+
+def test_migrate_product_migrated_concurrently(
+    product, redis_client, stored_product, monkeypatch
+):
+    store_hash(redis_client, product)
+    from_hash = migrations._from_hash
+    concurrent = []
+
+    def from_hash_racing(document):
+        # another run migrates the product, and an order takes some of its
+        # stock, after this run read the hash
+        if not concurrent:
+            concurrent.append(None)
+            assert migrate_product(redis_client, 'products:LZ127')
+            redis_client.hincrby(STOCK_KEY, 'LZ127', -2)
+            redis_client.decrby(STOCK_TOTAL_KEY, 2)
+        return from_hash(document)
+
+    monkeypatch.setattr(migrations, '_from_hash', from_hash_racing)
+
+    assert not migrate_product(redis_client, 'products:LZ127')
+
+    assert dict(product, in_stock=9) == stored_product('LZ127')
+    assert b'9' == redis_client.get(STOCK_TOTAL_KEY)
+
+
+def test_main(product, redis_client, stored_product, tmpdir, capsys):
+    store_hash(redis_client, product)
+    config_file = tmpdir.join('config.yml')
+    config_file.write('{}: {}\n'.format(REDIS_URI_KEY, config[REDIS_URI_KEY]))
+
+    main([str(config_file)])
+
+    assert 'Migrated 1 products\n' == capsys.readouterr().out
+    assert product == stored_product('LZ127')
@@ -4,7 +4,8 @@ from nameko.standalone.events import event_dispatcher
 from nameko.testing.services import entrypoint_waiter
 import pytest
 
-from products.dependencies import NotFound
+from products.dependencies import NotFound, STOCK_KEY
+from products.exceptions import InvalidQuantity, OutOfStock, ProductExists
 from products.service import ProductsService
 
 
@@ -25,6 +26,21 @@ def test_get_product(create_product, service_container):
     assert stored_product == loaded_product
 
 
+def test_get_product_is_cached(
+    create_product, redis_client, service_container
+):
+
+    stored_product = create_product()
+
+    with entrypoint_hook(service_container, 'get') as get:
+        get(stored_product['id'])
+    redis_client.hset(STOCK_KEY, 'LZ127', 0)
+    with entrypoint_hook(service_container, 'get') as get:
+        loaded_product = get(stored_product['id'])
+
+    assert stored_product == loaded_product
+
+
 def test_get_product_fails_on_not_found(service_container):
 
     with pytest.raises(NotFound):
@@ -32,6 +48,24 @@ def test_get_product_fails_on_not_found(service_container):
             get(111)
 
 
+def test_get_many_products(products, service_container):
+
+    with entrypoint_hook(service_container, 'get_many') as get_many:
+        loaded_products = get_many(['LZ129', 'missing', 'LZ130'])
+
+    assert [products[1], products[2]] == loaded_products
+
+
+def test_get_stock_summary(product, service_container):
+
+    with entrypoint_hook(service_container, 'create') as create:
+        create(dict(product, id='LZ127', in_stock=10))
+        create(dict(product, id='LZ129', in_stock=0))
+
+    with entrypoint_hook(service_container, 'get_stock_summary') as summary:
+        assert {'total_in_stock': 10, 'skus_out_of_stock': 1} == summary()
+
+
 def test_list_products(products, service_container):
 
     with entrypoint_hook(service_container, 'list') as list_:
@@ -48,19 +82,33 @@ def test_list_productis_when_empty(service_container):
     assert [] == listed_products
 
 
-def test_create_product(product, redis_client, service_container):
+def test_create_product(product, stored_product, service_container):
 
     with entrypoint_hook(service_container, 'create') as create:
         create(product)
 
-    stored_product = redis_client.hgetall('products:LZ127')
+    assert product == stored_product('LZ127')
+
+
+def test_create_product_fails_when_exists(
+    create_product, product, service_container
+):
+
+    create_product()
+
+    with pytest.raises(ProductExists):
+        with entrypoint_hook(service_container, 'create') as create:
+            create(product)
+
 
-    assert product['id'] == stored_product[b'id'].decode('utf-8')
-    assert product['title'] == stored_product[b'title'].decode('utf-8')
-    assert product['maximum_speed'] == int(stored_product[b'maximum_speed'])
-    assert product['passenger_capacity'] == (
-        int(stored_product[b'passenger_capacity']))
-    assert product['in_stock'] == int(stored_product[b'in_stock'])
+def test_create_product_drops_unknown_fields(
+    product, stored_product, service_container
+):
+
+    with entrypoint_hook(service_container, 'create') as create:
+        create(dict(product, colour='silver'))
+
+    assert product == stored_product('LZ127')
 
 
 @pytest.mark.parametrize('product_overrides, expected_errors', [
@@ -126,27 +174,190 @@ def test_create_product_validation_error_on_non_nullable_fields(
         exc_info.value.args[0])
 
 
-def test_handle_order_created(
+def test_reserve_stock(products, stored_product, service_container):
+
+    with entrypoint_hook(service_container, 'reserve_stock') as reserve:
+        reserved = reserve([
+            {'product_id': 'LZ129', 'quantity': 2},
+            {'product_id': 'LZ127', 'quantity': 4},
+        ], 1)
+
+    assert reserved is True
+    product_one, product_two, product_three = [
+        stored_product(id_) for id_ in ('LZ127', 'LZ129', 'LZ130')]
+    assert 6 == product_one['in_stock']
+    assert 9 == product_two['in_stock']
+    assert 12 == product_three['in_stock']
+
+
+def test_reserve_stock_invalidates_cached_product(
+    products, service_container
+):
+
+    with entrypoint_hook(service_container, 'get') as get:
+        get('LZ129')
+
+    with entrypoint_hook(service_container, 'reserve_stock') as reserve:
+        reserve([{'product_id': 'LZ129', 'quantity': 2}], 1)
+
+    with entrypoint_hook(service_container, 'get') as get:
+        loaded_product = get('LZ129')
+
+    assert 9 == loaded_product['in_stock']
+
+
+def test_reserve_stock_when_out_of_stock(
+    products, stored_product, service_container
+):
+
+    with pytest.raises(OutOfStock):
+        with entrypoint_hook(service_container, 'reserve_stock') as reserve:
+            reserve([
+                {'product_id': 'LZ129', 'quantity': 2},
+                {'product_id': 'LZ127', 'quantity': 40},
+            ], 1)
+
+    product_one, product_two = [
+        stored_product(id_) for id_ in ('LZ127', 'LZ129')]
+    assert 10 == product_one['in_stock']
+    assert 11 == product_two['in_stock']
+
+
+def test_reserve_stock_fails_on_not_found(
+    products, stored_product, service_container
+):
+
+    with pytest.raises(NotFound):
+        with entrypoint_hook(service_container, 'reserve_stock') as reserve:
+            reserve([
+                {'product_id': 'LZ129', 'quantity': 2},
+                {'product_id': 'missing', 'quantity': 1},
+            ], 1)
+
+    assert 11 == stored_product('LZ129')['in_stock']
+
+
+def test_reserve_stock_fails_on_negative_quantity(
+    products, redis_client, stored_product, service_container
+):
+
+    with pytest.raises(InvalidQuantity):
+        with entrypoint_hook(service_container, 'reserve_stock') as reserve:
+            reserve([
+                {'product_id': 'LZ129', 'quantity': 2},
+                {'product_id': 'LZ127', 'quantity': -5},
+            ], 1)
+
+    assert 10 == stored_product('LZ127')['in_stock']
+    assert 11 == stored_product('LZ129')['in_stock']
+    assert not redis_client.exists('orders:seen:1')
+
+
+def test_reserve_stock_once_per_order(
+    products, stored_product, service_container
+):
+
+    reserved = []
+    for _ in range(2):
+        with entrypoint_hook(service_container, 'reserve_stock') as reserve:
+            reserved.append(
+                reserve([{'product_id': 'LZ129', 'quantity': 2}], 1))
+
+    assert [True, False] == reserved
+    assert 9 == stored_product('LZ129')['in_stock']
+
+
+def test_reserve_stock_folds_order_lines(
+    products, stored_product, service_container
+):
+
+    with entrypoint_hook(service_container, 'reserve_stock') as reserve:
+        reserve([
+            {'product_id': 'LZ129', 'quantity': 2},
+            {'product_id': 'LZ127', 'quantity': 0},
+            {'product_id': 'LZ129', 'quantity': 3},
+        ], 1)
+
+    assert 10 == stored_product('LZ127')['in_stock']
+    assert 6 == stored_product('LZ129')['in_stock']
+
+
+def test_reserve_stock_skips_orders_without_quantities(
+    products, redis_client, stored_product, service_container
+):
+
+    with entrypoint_hook(service_container, 'reserve_stock') as reserve:
+        reserved = reserve([
+            {'product_id': 'LZ129', 'quantity': 0},
+            {'product_id': 'LZ127', 'quantity': 0},
+        ], 1)
+
+    assert reserved is True
+    assert 10 == stored_product('LZ127')['in_stock']
+    assert 11 == stored_product('LZ129')['in_stock']
+    assert not redis_client.exists('orders:seen:1')
+
+
+def test_release_stock(
+    products, redis_client, stored_product, service_container
+):
+
+    with entrypoint_hook(service_container, 'reserve_stock') as reserve:
+        reserve([
+            {'product_id': 'LZ129', 'quantity': 2},
+            {'product_id': 'LZ127', 'quantity': 4},
+        ], 1)
+
+    with entrypoint_hook(service_container, 'get') as get:
+        get('LZ129')
+
+    with entrypoint_hook(service_container, 'release_stock') as release:
+        release(1)
+
+    with entrypoint_hook(service_container, 'get') as get:
+        loaded_product = get('LZ129')
+
+    assert 11 == loaded_product['in_stock']
+    assert 10 == stored_product('LZ127')['in_stock']
+    assert not redis_client.exists('orders:seen:1')
+
+
+def test_handle_order_created_invalidates_cached_product(
     test_config, products, redis_client, service_container
 ):
 
-    dispatch = event_dispatcher()
+    with entrypoint_hook(service_container, 'get') as get:
+        get('LZ129')
+
+    # stock taken by a reservation made on another worker
+    redis_client.hset(STOCK_KEY, 'LZ129', 9)
 
+    dispatch = event_dispatcher()
     payload = {
         'order': {
+            'id': 1,
             'order_details': [
                 {'product_id': 'LZ129', 'quantity': 2},
-                {'product_id': 'LZ127', 'quantity': 4},
             ]
         }
     }
-
     with entrypoint_waiter(service_container, 'handle_order_created'):
         dispatch('orders', 'order_created', payload)
 
-    product_one, product_two, product_three = [
-        redis_client.hgetall('products:{}'.format(id_))
-        for id_ in ('LZ127', 'LZ129', 'LZ130')]
-    assert b'6' == product_one[b'in_stock']
-    assert b'9' == product_two[b'in_stock']
-    assert b'12' == product_three[b'in_stock']
+    with entrypoint_hook(service_container, 'get') as get:
+        loaded_product = get('LZ129')
+
+    assert 9 == loaded_product['in_stock']
+
+
+def test_handle_order_created_reaches_every_instance(
+    test_config, container_factory, service_container
+):
+    other_container = container_factory(ProductsService)
+    other_container.start()
+
+    dispatch = event_dispatcher()
+    payload = {'order': {'id': 1, 'order_details': []}}
+    with entrypoint_waiter(service_container, 'handle_order_created'):
+        with entrypoint_waiter(other_container, 'handle_order_created'):
+            dispatch('orders', 'order_created', payload)